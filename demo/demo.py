@@ -110,7 +110,7 @@ def build_project_params(project):
     if project == AND_PROJECT:
         params['training_data'], params['testing_data'] =  demo_data.and_data()
         params['activation_functions'] = ['logistic']
-        params['num_neurons_list'] = [len(params['training_data'][0][1]), 1] # just single layer perceptron
+        params['num_neurons_list'] = [len(params['training_data'][0][0]), 1] # just single layer perceptron
         params['learning_rate'] = 0.2
         params['iterations'] = 1
         params['num_processes'] = 1
@@ -125,7 +125,7 @@ def build_project_params(project):
     elif project == IRIS_PROJECT:
         params['training_data'], params['testing_data'] = demo_data.iris_data()
         params['activation_functions'] = ['logistic'] * 2
-        params['num_neurons_list'] = [10, 3]
+        params['num_neurons_list'] = [len(params['training_data'][0][0]), 10, 3]
         params['learning_rate'] = 0.02 #0.007
         params['momentum_coef'] = 0.0 #0.4
         params['learning_rate_change'] = -0.00 #0.2
@@ -135,7 +135,7 @@ def build_project_params(project):
     elif project == LETTER_RECOG_PROJECT:
         params['training_data'], params['testing_data'] = demo_data.letter_recognition_data()
         params['activation_functions'] = ['logistic'] * 2
-        params['num_neurons_list'] = [80, 26]
+        params['num_neurons_list'] = [len(params['training_data'][0][0]), 80, 26]
         params['learning_rate'] = 0.2 #0.2
         params['momentum_coef'] = 0.0
         params['learning_rate_change'] = 0.0 #0.2
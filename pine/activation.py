@@ -5,6 +5,8 @@ Created on Oct 9, 2014
 '''
 import math
 
+import numpy as np
+
 class Logistic(object):
     """The Logistic (Sigmoid) activation function, which is one of the
         possibilities that can be used by the network
@@ -16,16 +18,36 @@ class Logistic(object):
     def activate(self, input_value):
         """Run the input value through the sigmoid function
         This will only return values between 0 and 1
+
+        Uses the numerically stable form
+            1/(1+e^-x)      for x >= 0
+            e^x/(1+e^x)     for x < 0
+        so the exponent is never positive, and it can never overflow
         """
-        try:
-            return 1 / (1 + math.exp(-1*input_value))
-        except OverflowError:
-            # bound the numbers if there is an overflow
-            print("overflow")
-            if input_value < 0:
-                return 0.0000000000001 #logistic func goes to 0 for small x
+        if input_value >= 0:
+            z = math.exp(-input_value)
+            return 1.0 / (1.0 + z)
+        z = math.exp(input_value)
+        return z / (1.0 + z)
+
+    def activate_vec(self, input_array, out=None):
+        """Run each value of the input array through the sigmoid function,
+        storing the results in out if given (which may be the input array)
+
+        Every step is done in place in the result, without any temporary
+        arrays.  For very negative x, e^-x overflows to inf, which still
+        gives the correct limit, 1/(1+inf) = 0, so that overflow is ignored
+        """
+        with np.errstate(over='ignore'):
+            if out is None:
+                # a new result, which is floating point even for an integer
+                #    input array
+                result = np.multiply(input_array, -1.0)
             else:
-                return 0.9999999999999
+                result = np.negative(input_array, out=out)
+            np.exp(result, out=result)
+            result += 1.0
+            return np.divide(1.0, result, out=result)
 
     def derivative(self, fx):
         """Calculate derivative of logistic function, given an output F(x)
@@ -37,6 +59,16 @@ class Logistic(object):
         """
         return fx*(1-fx)
 
+    def derivative_vec(self, fx, out=None):
+        """Derivative of the logistic function over an array of outputs
+        F(x), stored in out if given (which may not be fx itself)
+
+        Computed in place in the result as (1 - F(x)) * F(x)
+        """
+        result = np.subtract(1.0, fx, out=out)
+        result *= fx
+        return result
+
     def inverse(self, input_value):
         """This will produce the inverse of the sigmoid function, which is
         useful in determining the original value before activation
@@ -79,6 +111,17 @@ class Logistic(object):
         dc = (y-1)/(hx-1) - y/hx 
         return dc
 
+    def output_delta(self, hypothesis_output, target_output, out=None):
+        """Delta (partial deriv of the cost function wrt the input) of an
+        output neuron using the logistic activation function, or of an
+        array of them (stored in out if given)
+
+        With the logistic cost function, the derivative simplifies down to
+            just subtracting the target from the hypothesis
+
+        """
+        return np.subtract(hypothesis_output, target_output, out=out)
+
 
 class Tanh(object):
     """The Tanh (Logistic spinoff) activation function, which is one of the
@@ -90,14 +133,28 @@ class Tanh(object):
 
     def activate(self, input_value):
         """Run the input value through the tanh function"""
-        #return math.tanh(input_value)
-        return ((math.exp(input_value)-math.exp(-input_value)) /
-               (math.exp(input_value)+math.exp(-input_value)))
+        return math.tanh(input_value)
+
+    def activate_vec(self, input_array, out=None):
+        """Run each value of the input array through the tanh function,
+        storing the results in out if given
+        """
+        return np.tanh(input_array, out=out)
 
     def derivative(self, fx):
         """Some training will require the derivative of the tanh function"""
         return (1.0-fx) * (1.0+fx)
 
+    def derivative_vec(self, fx, out=None):
+        """Derivative of the tanh function over an array of outputs F(x),
+        stored in out if given (which may not be fx itself)
+
+        Computed in place in the result as 1 - F(x)^2, which equals
+            (1 - F(x)) * (1 + F(x))
+        """
+        result = np.multiply(fx, fx, out=out)
+        return np.subtract(1.0, result, out=result)
+
     def inverse(self, input_value):
         """This will produce the inverse of the tanh function, which is
         useful in determining the original value before activation
@@ -128,6 +185,18 @@ class Tanh(object):
         dc = hx - y
         return dc
 
+    def output_delta(self, hypothesis_output, target_output, out=None):
+        """Delta (partial deriv of the cost function wrt the input) of an
+        output neuron using the tanh activation function, or of an array of
+        them (stored in out if given)
+
+        delta = (h_theta(x) - y) * F'(h_theta(x))
+
+        """
+        delta = np.subtract(hypothesis_output, target_output, out=out)
+        delta *= self.derivative(hypothesis_output)
+        return delta
+
 
 class Linear(object):
     """The Linear activation function, which is one of the
@@ -141,12 +210,30 @@ class Linear(object):
         """In the linear function, f(z) = z"""
         return input_value
 
+    def activate_vec(self, input_array, out=None):
+        """In the linear function, f(z) = z, for each value of the array,
+        copied into out if given
+        """
+        if out is None:
+            return input_array
+        np.copyto(out, input_array)
+        return out
+
     def derivative(self, fx):
         """Some training will require the derivative of the linear function
         which is just 1
         """
         return 1
 
+    def derivative_vec(self, fx, out=None):
+        """Derivative of the linear function over an array of outputs F(x),
+        which is just an array of 1s (stored in out if given)
+        """
+        if out is None:
+            return np.ones_like(fx)
+        out.fill(1)
+        return out
+
     def inverse(self, input_value):
         """This will produce the inverse of the linear function, which is
         useful in determining the original value before activation
@@ -177,3 +264,13 @@ class Linear(object):
         dc = hx - y
         return dc
 
+    def output_delta(self, hypothesis_output, target_output, out=None):
+        """Delta (partial deriv of the cost function wrt the input) of an
+        output neuron using the linear activation function, or of an array of
+        them (stored in out if given)
+
+        delta = (h_theta(x) - y) * F'(h_theta(x)), where F'(h_theta(x)) = 1
+
+        """
+        return np.subtract(hypothesis_output, target_output, out=out)
+
@@ -0,0 +1,142 @@
+'''
+Created on Oct 15, 2026
+'''
+import math
+
+try:
+    from numba import njit
+except ImportError:
+    # Numba is optional -> without it, these kernels still work, but run as
+    #    (slow) plain Python
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda function: function
+
+# integer ids for the activation functions, so that the compiled kernels
+#    can select one without any Python objects
+LOGISTIC = 0
+TANH = 1
+LINEAR = 2
+ACTIVATION_IDS = {"logistic": LOGISTIC, "tanh": TANH, "linear": LINEAR}
+
+
+@njit(cache=True)
+def activate(z, act_id):
+    """Run the input value z through the activation function act_id"""
+    if act_id == LOGISTIC:
+        if z >= 0:
+            return 1.0 / (1.0 + math.exp(-z))
+        e = math.exp(z)
+        return e / (1.0 + e)
+    elif act_id == TANH:
+        return math.tanh(z)
+    return z
+
+
+@njit(cache=True)
+def derivative(fx, act_id):
+    """Derivative of the activation function act_id, given an output F(x)"""
+    if act_id == LOGISTIC:
+        return fx * (1.0 - fx)
+    elif act_id == TANH:
+        return (1.0 - fx) * (1.0 + fx)
+    return 1.0
+
+
+# compiled training steps, keyed by network topology (see training_step)
+_training_steps = {}
+
+
+def training_step(topology):
+    """Return a compiled function that performs one training step (forward
+    pass, backward pass, and weight updates) on a single example, for a
+    network with the given topology
+
+    'topology' = tuple of (num inputs, num neurons, activation id) for each
+                     layer
+
+    The function is called as
+        step(x, y, learning_rate, momentum, W0, b0, a0, d0, vW0, vb0, ...)
+        with the weights, thresholds, activations, deltas, and last weight
+        and threshold changes (for momentum) arrays of each layer, which are
+        all updated in place.
+
+    The source of the function is generated with the sizes and activation
+        functions of every layer written in as constants, so that the
+        compiler can unroll the small loops and inline the activation
+        functions.  It is compiled once per topology, and then cached.
+
+    """
+    step = _training_steps.get(topology)
+    if step is None:
+        namespace = {'activate': activate, 'derivative': derivative}
+        exec(_training_step_source(topology), namespace)
+        step = njit(fastmath=True)(namespace['step'])
+        _training_steps[topology] = step
+    return step
+
+
+def _training_step_source(topology):
+    """Generate the source of the training step for the given topology
+
+    For each layer, with activations a, weights W, thresholds b, deltas d,
+        and last weight and threshold changes vW and vb:
+
+            a = f(W.a_prev + b)                      (forward)
+            d = (a - y)             for a logistic output layer
+            d = (a - y) * f'(a)     for a tanh or linear output layer
+            vW = learning_rate * outer(d, a_prev) + momentum * vW
+            vb = learning_rate * d + momentum * vb
+            W -= vW
+            b -= vb
+            d_prev = (W^T . d) * f'(a_prev)   for the layer before it
+
+    As in Backpropagation.train, the deltas of the layer before are computed
+        with this layer's updated weights.
+
+    """
+    num_layers = len(topology)
+    args = ['x', 'y', 'learning_rate', 'momentum']
+    for l in range(num_layers):
+        args += ['W{0}'.format(l), 'b{0}'.format(l), 'a{0}'.format(l),
+                 'd{0}'.format(l), 'vW{0}'.format(l), 'vb{0}'.format(l)]
+    lines = ['def step({0}):'.format(', '.join(args))]
+    # forward pass
+    for l, (num_inputs, num_neurons, act_id) in enumerate(topology):
+        a_prev = 'x' if l == 0 else 'a{0}'.format(l-1)
+        lines += ['    for j in range({0}):'.format(num_neurons),
+                  '        z = b{0}[j]'.format(l),
+                  '        for i in range({0}):'.format(num_inputs),
+                  '            z += W{0}[j, i] * {1}[i]'.format(l, a_prev),
+                  '        a{0}[j] = activate(z, {1})'.format(l, act_id)]
+    # output layer deltas
+    l = num_layers - 1
+    _, num_neurons, act_id = topology[l]
+    lines += ['    for j in range({0}):'.format(num_neurons),
+              '        d{0}[j] = a{0}[j] - y[j]'.format(l)]
+    if act_id != LOGISTIC:
+        lines += ['        d{0}[j] *= derivative(a{0}[j], {1})'.format(l,
+                                                                     act_id)]
+    # move backwards through the layers, updating this layer's weights
+    #    before computing the deltas of the previous layer with them
+    for l in range(num_layers-1, -1, -1):
+        num_inputs, num_neurons, _ = topology[l]
+        a_prev = 'x' if l == 0 else 'a{0}'.format(l-1)
+        lines += ['    for j in range({0}):'.format(num_neurons),
+                  '        step = learning_rate * d{0}[j]'.format(l),
+                  '        for i in range({0}):'.format(num_inputs),
+                  '            vW{0}[j, i] = (step * {1}[i] + '
+                  'momentum * vW{0}[j, i])'.format(l, a_prev),
+                  '            W{0}[j, i] -= vW{0}[j, i]'.format(l),
+                  '        vb{0}[j] = step + momentum * vb{0}[j]'.format(l),
+                  '        b{0}[j] -= vb{0}[j]'.format(l)]
+        if l > 0:
+            act_id = topology[l-1][2]
+            lines += ['    for i in range({0}):'.format(num_inputs),
+                      '        sum_value = 0.0',
+                      '        for j in range({0}):'.format(num_neurons),
+                      '            sum_value += W{0}[j, i] * d{0}[j]'.format(l),
+                      '        d{0}[i] = derivative(a{0}[i], {1}) * '
+                      'sum_value'.format(l-1, act_id)]
+    return '\n'.join(lines) + '\n'
@@ -5,6 +5,8 @@ Created on Jun 6, 2013
 '''
 import random
 
+import numpy as np
+
 
 class Network(object):
     """A class for the overall network"""
@@ -20,8 +22,12 @@ class Network(object):
             vector of the network
 
         """
-        for layer in self.layers:
-            input_vector = layer.forward(input_vector)
+        for layer_num, layer in enumerate(self.layers):
+            try:
+                input_vector = layer.forward(input_vector)
+            except ValueError as e:
+                # say which layer of the network was given the wrong inputs
+                raise ValueError("layer {0}: {1}".format(layer_num, e)) from None
         output_vector = input_vector
         return output_vector
 
@@ -49,10 +55,11 @@ class Network(object):
             chance of overfitting.
 
         """
-        thetas_squared = 0;
+        thetas_squared = 0.0
         for layer in self.layers:
-            for neuron in layer.neurons:
-                thetas_squared += sum([w**2 for w in neuron.weights])
+            # sum of the squares of all of the weights in the layer at once
+            weights = layer.as_arrays()[0].ravel()
+            thetas_squared += float(np.dot(weights, weights))
         cost = (sum(self.layers[-1].cost(target_output_vector))
                 + reg_lambda/2 * thetas_squared)
         return cost
@@ -85,19 +92,133 @@ class Network(object):
 
 
 class Layer(object):
-    """A class for layers in the network"""
+    """A class for layers in the network
+
+    The parameters of the neurons in this layer are stored together as
+        arrays (structure of arrays): a weights matrix W (num neurons x
+        num inputs, row-major, so row j holds the weights of neuron j), a
+        thresholds vector b, and an activations (outputs) vector a.  Each
+        neuron's weights, threshold, and output refer into these arrays.
+
+    """
 
     def __init__(self):
         """Constructor"""
         self.neurons = []
 
+    @property
+    def neurons(self):
+        """The neurons in this layer (as a tuple, see the setter)"""
+        return self._neurons
+
+    @neurons.setter
+    def neurons(self, neurons):
+        """
+        Set the neurons in this layer, moving their current parameters into
+            the arrays of this layer
+
+        Note: the neurons are kept as a tuple, so that they cannot be
+            appended to (which would leave them out of the arrays) -> assign
+            a new list instead, so that the arrays are rebuilt
+
+        """
+        num_inputs = len(neurons[0].weights) if neurons else 0
+        self._W = np.array([n.weights for n in neurons], dtype=float,
+                           order='C').reshape(len(neurons), num_inputs)
+        self._b = np.array([n.threshold for n in neurons], dtype=float)
+        self._a = np.array([n.output for n in neurons], dtype=float)
+        for j, neuron in enumerate(neurons):
+            neuron.attach(self._W, self._b, self._a, j)
+        self._neurons = tuple(neurons)
+
+    def __getstate__(self):
+        """Leave out any buffers when pickling (see allocate_buffers)"""
+        state = self.__dict__.copy()
+        state.pop('_buffers', None)
+        return state
+
+    def __setstate__(self, state):
+        """
+        Restore a pickled layer, including one pickled before the neurons'
+            parameters were stored in the layer's arrays, which only has a
+            list of neurons (see Neuron.__setstate__)
+
+        """
+        neurons = state.pop('neurons', None)
+        self.__dict__.update(state)
+        if neurons is not None:
+            self.neurons = neurons
+
+    @property
+    def activation_function(self):
+        """The activation function shared by the neurons in this layer"""
+        return self.neurons[0].activation_function
+
+    def as_arrays(self):
+        """
+        Return the weights, thresholds, and activations of this layer's
+            neurons as arrays (W, b, a), where row j of W holds the weights
+            of neuron j
+
+        These are the arrays the neurons' values are stored in, so any
+            changes made to them are seen by the neurons
+
+        """
+        return self._W, self._b, self._a
+
+    def allocate_buffers(self, max_batch, dtype=float, array_module=np):
+        """
+        Return buffers for computing a batch of up to max_batch examples at
+            once with this layer, as a tuple of:
+                -net inputs (max_batch x num neurons)
+                -activations (max_batch x num neurons)
+                -deltas (max_batch x num neurons)
+                -weight gradients (num neurons x num inputs)
+                -threshold gradients (num neurons)
+
+        The buffers are allocated with the given array module (numpy, or
+            a NumPy-like module such as cupy), kept by the layer, and only
+            allocated again if they are too small or of a different type
+
+        """
+        num_neurons, num_inputs = self._W.shape
+        buffers = getattr(self, '_buffers', None)
+        if (buffers is None or buffers[0].shape[0] < max_batch or
+                buffers[0].shape[1] != num_neurons or
+                buffers[3].shape[1] != num_inputs or
+                buffers[0].dtype != dtype or
+                not isinstance(buffers[0], array_module.ndarray)):
+            empty = array_module.empty
+            buffers = (empty((max_batch, num_neurons), dtype=dtype),
+                       empty((max_batch, num_neurons), dtype=dtype),
+                       empty((max_batch, num_neurons), dtype=dtype),
+                       empty((num_neurons, num_inputs), dtype=dtype),
+                       empty(num_neurons, dtype=dtype))
+            self._buffers = buffers
+        return buffers
+
     def forward(self, input_vector):
         """
         Given an input vector [from previous layer], compute the output vector
             of this layer of neurons in a forward pass
 
         """
-        output_vector = [n.forward(input_vector) for n in self.neurons]
+        num_inputs = self._W.shape[1]
+        if len(input_vector) != num_inputs:
+            raise ValueError("layer of {0} neurons expects {1} inputs, but "
+                             "was given {2}".format(len(self.neurons),
+                                                    num_inputs,
+                                                    len(input_vector)))
+        # keep track of what inputs were sent to the neurons
+        for neuron in self.neurons:
+            neuron.input_vector = input_vector
+        # compute all of the neuron outputs at once using the arrays, in
+        #    place in the activations array
+        #    -see Neuron.forward for the computation of a single neuron
+        np.dot(self._W, input_vector, out=self._a)
+        self._a += self._b
+        self.activation_function.activate_vec(self._a, out=self._a)
+        output_vector = self._a.tolist()
         return output_vector
 
     def backward(self, downstream_gradient_vector):
@@ -157,10 +278,18 @@ class Layer(object):
 
 
 class Neuron(object):
-    """A class for neurons in the network"""
+    """A class for neurons in the network
+
+    The weights, threshold, and output of a neuron are stored in row j of
+        arrays that are shared with the rest of the neurons in its layer
+        (see Layer).  Until the neuron is added to a layer, it has its own
+        single-row arrays.
+
+    """
 
     def __init__(self, num_inputs, activation_function):
         """Constructor"""
+        self.attach(np.empty((1, num_inputs)), np.empty(1), np.empty(1), 0)
         self.input_vector = [0]*num_inputs # inputs coming from prev neurons
         self.output = 0.0 # the activation of this neuron
         self.activation_function = activation_function
@@ -171,6 +300,64 @@ class Neuron(object):
         self.weight_gradients = [0]*num_inputs
         self.threshold_gradient = 0
 
+    def attach(self, W, b, a, j):
+        """
+        Store the weights, threshold, and output of this neuron in row j of
+            the given weights matrix, thresholds vector, and activations
+            vector, respectively
+
+        Note: this does not copy the current values into the arrays
+
+        """
+        self._W = W
+        self._b = b
+        self._a = a
+        self._j = j
+
+    def __setstate__(self, state):
+        """
+        Restore a pickled neuron, including one pickled before the
+            parameters were stored in arrays, which has its own weights
+            list, threshold, and output -> these are moved into single-row
+            arrays, until its layer is restored (see Layer.__setstate__)
+
+        """
+        if 'weights' in state:
+            weights = state.pop('weights')
+            threshold = state.pop('threshold')
+            output = state.pop('output')
+            self.attach(np.array([weights], dtype=float).reshape(1, -1),
+                        np.array([threshold], dtype=float),
+                        np.array([output], dtype=float), 0)
+        self.__dict__.update(state)
+
+    @property
+    def weights(self):
+        """The weights of this neuron (a view into its layer's weights)"""
+        return self._W[self._j]
+
+    @weights.setter
+    def weights(self, weights):
+        self._W[self._j] = weights
+
+    @property
+    def threshold(self):
+        """The threshold of this neuron (as a Python float)"""
+        return self._b.item(self._j)
+
+    @threshold.setter
+    def threshold(self, threshold):
+        self._b[self._j] = threshold
+
+    @property
+    def output(self):
+        """The activation of this neuron (as a Python float)"""
+        return self._a.item(self._j)
+
+    @output.setter
+    def output(self, output):
+        self._a[self._j] = output
+
     def forward(self, input_vector):
         """
         Given an input vector from previous layer neurons, compute the output 
@@ -186,7 +373,11 @@ class Neuron(object):
         self.input_vector = input_vector
         # multiply each input with the associated weight for that connection,
         #  then add the threshold value
-        net_input = (sum([x*y for x, y in zip(input_vector, self.weights)])
+        #  -Note: the weights are converted to a list of Python floats first,
+        #      which are much faster to work with one at a time than NumPy
+        #      scalars (this holds for the other per-weight loops too)
+        net_input = (sum([x*y for x, y in zip(input_vector,
+                                              self.weights.tolist())])
                      + self.threshold)
         # finally, use the activation function to compute the output
         self.output = self.activation_function.activate(net_input)
@@ -214,12 +405,13 @@ class Neuron(object):
         """
         chain_gradient = (downstream_gradient * 
                           self.activation_function.derivative(self.output))
-        for i in range(len(self.weights)):
+        weights = self.weights.tolist()
+        for i in range(len(weights)):
             self.weight_gradients[i] += chain_gradient * self.input_vector[i]
         self.threshold_gradient += chain_gradient#* 1, b/c thresh 'input' = 1
         input_gradients = [0]*len(self.input_vector)
         for i in range(len(self.input_vector)):
-            input_gradients[i] = chain_gradient * self.weights[i]
+            input_gradients[i] = chain_gradient * weights[i]
         return input_gradients
 
     def cost(self, target_output):
@@ -256,10 +448,12 @@ class Neuron(object):
             further, which will push the weights towards 0.
 
         """
-        for i in range(len(self.weights)):
-            self.weights[i] -= (learning_rate/batch_size * 
-                                (self.weight_gradients[i] + 
-                                 reg_lambda*self.weights[i]))
+        weights = self.weights.tolist()
+        for i in range(len(weights)):
+            weights[i] -= (learning_rate/batch_size * 
+                           (self.weight_gradients[i] + 
+                            reg_lambda*weights[i]))
+        self.weights = weights
         self.threshold -= learning_rate/batch_size * (self.threshold_gradient)
 
     def reset_gradients(self):
@@ -3,9 +3,21 @@ Created on Oct 13, 2014
 
 @author: dusenberrymw
 '''
-from multiprocessing import Process, Queue, cpu_count
+import atexit
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import cpu_count
+from multiprocessing.shared_memory import SharedMemory
 import random
 
+import numpy as np
+try:
+    import cupy
+except ImportError:
+    # CuPy is optional, and only needed to train on the GPU
+    cupy = None
+
+import pine.util
+
 class SGD(object):
     """
     Class for the Stochastic Gradient Descent (backpropagation) trainer
@@ -82,6 +94,13 @@ class Backpropagation(object):
             will give direction of gradient AScent, and we want to move in the
             opposite direction in order to lower the overall error (minimize
             the cost function, J).
+        With momentum, each change is also carried over to the next update,
+            scaled by the momentum coefficient:
+                change = learning_rate * gradient + momentum * last change
+            so that the updates keep moving in a consistent direction rather
+            than oscillating.  The last changes are stored in one array per
+            layer, shaped like the weights (and thresholds), for the length
+            of this call to train.
 
         """
         if unsupervised:
@@ -99,10 +118,41 @@ class Backpropagation(object):
             # Then perform normal backpropagation, and during that, for each
             #    hidden node, also update the rho_estimate, and then update the
             #    threshold value
+            # Note: the estimates are kept separately for each layer, in the
+            #    same reversed (backwards) order as layers_rev below
             rho = 0.05
-            rho_estimates = [0] * len(network.layers[0].neurons) # set to 0 for each node
+            rho_estimates = [np.zeros(len(layer.neurons)) # set to 0 for each node
+                             for layer in reversed(network.layers)]
             beta = 0.2 # the learning rate for updating the threshold terms
-        for iteration_counter in range(iterations):
+        # look up everything that stays the same during training once,
+        #    rather than for every example
+        #    -the layers in reverse (backwards) order, with the arrays,
+        #     the last weight and threshold changes (for momentum), buffers
+        #     (deltas, scratch, and weight gradients), inputs, and
+        #     activation derivative of each, so that the per-layer arrays
+        #     are only looked up or allocated once
+        #    -Note: a few small arrays are still created for each example:
+        #        the example's input and target vectors converted to arrays,
+        #        and the temporaries of a tanh output layer's deltas and of
+        #        the sparsity update
+        #    -Note: the inputs of each layer after the first are the
+        #        activations of the layer before it, which are always in
+        #        that layer's activations array -> the first layer's inputs
+        #        are the example's input vector instead (None here)
+        lr = self.learning_rate
+        mom = self.momentum_coef
+        layers = network.layers
+        layers_rev = []
+        for l in range(len(layers)-1, -1, -1):
+            arrays = layers[l].as_arrays()
+            changes = (np.zeros_like(arrays[0]), np.zeros_like(arrays[1]))
+            buffers = (np.empty_like(arrays[1]), np.empty_like(arrays[1]),
+                       np.empty_like(arrays[0]))
+            inputs = layers[l-1].as_arrays()[2] if l > 0 else None
+            layers_rev.append((arrays, changes, buffers, inputs,
+                               layers[l].activation_function.derivative_vec))
+        output_delta = network.layers[-1].activation_function.output_delta
+        for _ in range(iterations):
             random.shuffle(training_examples)
             # for each row of data
             for training_example in training_examples:
@@ -112,90 +162,353 @@ class Backpropagation(object):
                 #    -this will cause output (activation) values to be
                 #     set for each neuron
                 network.forward(input_vector)
+                example_inputs = np.asarray(input_vector, dtype=float)
 
-                # Note: next_layer_deltas is a vector of the single
-                #    delta values for each node in the next
-                #    (forward) layer
-                next_layer_deltas = []
-                next_layer_weights = []
+                # Note: next_layer_deltas is the vector of the delta values
+                #    for each node in the next (forward) layer
+                next_layer_deltas = None
+                next_layer_weights = None
                 isOutputLayer = True
-                for layer in reversed(network.layers): # iterate backwards
-                    this_layer_deltas = [] # values from current layer
-                    this_layer_weights = []
-                    for j, neuron in enumerate(layer.neurons):
-                        derivative = neuron.activation_function.derivative
+                for layer_num, ((weights, thresholds, outputs),
+                                (weight_changes, threshold_changes),
+                                (deltas, scratch, gradients), layer_inputs,
+                                derivative_vec) in enumerate(
+                                    layers_rev): # iterate backwards
+                    # work directly on the layer's arrays (row j of the
+                    #    weights matrix holds the weights of neuron j), for
+                    #    all of the neurons in the layer at once
+                    if layer_inputs is None:
+                        layer_inputs = example_inputs
+                    if isOutputLayer:
                         # The output layer neurons are treated slightly
-                        #    different than the hidden neurons
-                        if isOutputLayer:
-                            if neuron.activation_function.name == "logistic":
-                                # derivative simplifies down to just
-                                #    subtracting the target from the
-                                #    hypothesis
-                                delta = neuron.output - target_output_vector[j]
-                            else: # Tanh or Linear
-                                delta = (neuron.output-target_output_vector[j])*derivative(neuron.output)
-                        else: # for the hidden layer neurons
-                            # Need to sum the products of the delta of
-                            #    a neuron in the next (forward) layer and the
-                            #    weight associated with the connection between
-                            #    this hidden layer neuron and that neuron.
-                            # This will basically determine how much this
-                            #    neuron contributed to the error of the neuron
-                            #    it is connected to
-                            # Note: next_layer_deltas is a vector of the 
-                            #    single delta values for each node in the next
-                            #    (forward) layer
-                            sum_value = 0.0
-                            for next_delta, weights in zip(next_layer_deltas,
-                                                         next_layer_weights):
-                                sum_value +=  weights[j] * next_delta
-                            delta = (derivative(neuron.output) *
-                                              sum_value)
-                        # now store the delta and the list of weights
-                        #    for this neuron into these storage lists for the
-                        #    whole layer
-                        this_layer_deltas.append(delta)
-                        this_layer_weights.append(neuron.weights)
-                        # Now, compute the gradient (partial deriv of cost
-                        #    func, J, w/ respect to parameter ij) for each
-                        #    weight_ij (parameter_ij) associated with
-                        #    this neuron
-                        for ij, input_ij in enumerate(neuron.input_vector):
-                            # compute gradient (partial deriv of cost J w/
-                            #    respect to parameter ij)
-                            # Note: index ij means from a previous
-                            #    layer node i to this layer node j
-                            # Then Gradient Descent: multiply by the learning
-                            #    rate, and subtract from the current value
-                            # Note: Subtract in order to minimize error, since
-                            #    partial derivs point in direction of gradient
-                            #    AScent
-                            gradient_ij = delta * input_ij
-                            neuron.weights[ij] -= self.learning_rate * gradient_ij
-                        # Now, compute the gradient (partial deriv of cost
-                        #    func, J, with respect to parameter ij) for the
-                        #    threshold value (parameter_0j), by using a "1" as
-                        #    the threshold "input value"
-                        # -Note: index 0j means from a previous
-                        #    layer threshold node 0 (threshold always has
-                        #    index i=0) to this layer node j
-                        #        -can also think of it as the threshold being
-                        #            internal to this neuron
-                        gradient_0j = delta * 1
-                        neuron.threshold -= self.learning_rate * gradient_0j
-                        if unsupervised and not isOutputLayer:
-                            rho_estimates[j] = (0.999*rho_estimates[j] +
-                                                0.001*neuron.output)
-                            neuron.threshold -= (self.learning_rate * beta *
-                                                 (rho_estimates[j] - rho))
-                    # Once this layer is done, store the gradients and weights
-                    #    from the current layer for the next layer iteration
-                    #    (moving backwards)
-                    next_layer_deltas = this_layer_deltas
-                    next_layer_weights = this_layer_weights
+                        #    different than the hidden neurons, and their
+                        #    deltas only depend on the output and target
+                        #    -see output_delta of the activation function
+                        deltas = output_delta(
+                            outputs, np.asarray(target_output_vector,
+                                                dtype=float), out=deltas)
+                    else: # for the hidden layer neurons
+                        # Need to sum the products of the delta of
+                        #    a neuron in the next (forward) layer and the
+                        #    weight associated with the connection between
+                        #    this hidden layer neuron and that neuron.
+                        # This will basically determine how much this
+                        #    neuron contributed to the error of the neuron
+                        #    it is connected to
+                        # For all of the neurons, these sums are the product
+                        #    of the next layer's deltas and weights matrix
+                        #    (W^T . deltas)
+                        deltas = np.dot(next_layer_deltas, next_layer_weights,
+                                        out=deltas)
+                        deltas *= derivative_vec(outputs, out=scratch)
+                    # Now, compute the gradient (partial deriv of cost
+                    #    func, J, w/ respect to parameter ij) for each
+                    #    weight_ij (parameter_ij), which is delta_j * input_i,
+                    #    so for the whole layer, the outer product of the
+                    #    deltas and the inputs
+                    # Note: index ij means from a previous
+                    #    layer node i to this layer node j
+                    # Then Gradient Descent: multiply by the learning
+                    #    rate, and subtract from the current value
+                    # Note: Subtract in order to minimize error, since
+                    #    partial derivs point in direction of gradient
+                    #    AScent
+                    # Note: the learning rate is applied to the deltas
+                    #    first, which is cheaper than to the whole matrix
+                    steps = np.multiply(deltas, lr, out=scratch)
+                    np.multiply.outer(steps, layer_inputs, out=gradients)
+                    # Now, do the same for the threshold values (parameter_0j),
+                    #    by using a "1" as the threshold "input value", so
+                    #    the gradients are just the deltas
+                    # -Note: index 0j means from a previous
+                    #    layer threshold node 0 (threshold always has
+                    #    index i=0) to this layer node j
+                    #        -can also think of it as the threshold being
+                    #            internal to this neuron
+                    if mom:
+                        # the changes also include the last changes, scaled
+                        #    by the momentum coefficient
+                        weight_changes *= mom
+                        weight_changes += gradients
+                        weights -= weight_changes
+                        threshold_changes *= mom
+                        threshold_changes += steps
+                        thresholds -= threshold_changes
+                    else:
+                        weights -= gradients
+                        thresholds -= steps
+                    if unsupervised and not isOutputLayer:
+                        # update the running estimates and thresholds of
+                        #    all the hidden neurons in this layer at once
+                        #    -Note: the thresholds of this layer do not
+                        #        affect any of the deltas above, so this can
+                        #        be done after the updates
+                        _update_sparsity(rho_estimates[layer_num], outputs,
+                                         thresholds, lr * beta, rho)
+                    # Once this layer is done, store the deltas and the
+                    #    (updated) weights from the current layer for the
+                    #    next layer iteration (moving backwards)
+                    next_layer_deltas = deltas
+                    next_layer_weights = weights
                     isOutputLayer = False
-        # Note: this is after the while loop
-        self.iterations = iteration_counter
+        self.iterations = iterations
+
+    def train_vectorized(self, network, training_examples, iterations,
+                         unsupervised=False, batch_size=1,
+                         forward_dtype=None, device='cpu'):
+        """Vectorized version of train, which performs the same training
+        algorithm, but on the arrays of each layer (see Layer.as_arrays)
+        rather than neuron by neuron and weight by weight
+
+        The examples are processed in mini-batches of batch_size examples,
+        stacked as the rows of an input matrix X and a target matrix Y.  For
+        each layer, with weights W, thresholds b, and activations A (one row
+        per example):
+
+            A = f(A_prev . W^T + b)                     (forward)
+            D = (A - Y)             for a logistic output layer
+            D = (A - Y) * f'(A)     for a tanh or linear output layer
+            V_W = (learning_rate/batch_size) * D^T . A_prev + momentum * V_W
+            V_b = (learning_rate/batch_size) * sum of the rows of D
+                      + momentum * V_b
+            W -= V_W
+            b -= V_b
+            D_prev = (D . W) * f'(A_prev)   for the layer before it
+
+        where V_W and V_b are the last changes to the weights and thresholds.
+        As in train, the delta of the layer before is computed with this
+        layer's updated weights.
+
+        A batch_size of 1 is plain stochastic gradient descent, as in train.
+
+        For a sparse autoencoder, the running estimates of the average hidden
+        activations are updated once per batch with the mean activations of
+        the batch, decayed as if by one update per example, and the
+        thresholds nudged by the batch size times the step of train.
+
+        If forward_dtype is given (e.g. numpy.float32), the forward and
+        backward passes use copies of the weights and thresholds cast to that
+        lower precision type, which halves the memory traffic of the matrix
+        products.  The updates are still applied to the full precision
+        parameters of the network, and the copies refreshed from them.
+
+        If device is 'gpu', the training is done on the GPU with CuPy, which
+        mirrors the NumPy API, so the same code runs on either device.  The
+        parameters and all of the examples are copied to the GPU once at the
+        start, and the parameters copied back at the end.
+
+        """
+        if device == 'gpu':
+            if cupy is None:
+                raise ValueError("training on the GPU requires CuPy")
+            xp = cupy
+            to_numpy = cupy.asnumpy
+        elif device == 'cpu':
+            xp = np
+            to_numpy = np.asarray
+        else:
+            raise ValueError("device must be 'cpu' or 'gpu'")
+        if not training_examples:
+            # nothing to train on (as with train and train_compiled)
+            self.iterations = iterations
+            return
+        layers = network.layers
+        arrays = [layer.as_arrays() for layer in layers]
+        # the parameters to train, which are the network's own arrays on the
+        #    cpu, or copies of them on the gpu
+        params = [(xp.asarray(W), xp.asarray(b)) for W, b, _ in arrays]
+        if forward_dtype is None:
+            forward_arrays = params
+        else:
+            forward_arrays = [(W.astype(forward_dtype),
+                               b.astype(forward_dtype))
+                              for W, b in params]
+        activations = [layer.activation_function.activate_vec
+                       for layer in layers]
+        derivatives = [layer.activation_function.derivative_vec
+                       for layer in layers]
+        output_delta = layers[-1].activation_function.output_delta
+        dtype = float if forward_dtype is None else forward_dtype
+        inputs = xp.array([example[0] for example in training_examples],
+                          dtype=dtype)
+        targets = xp.array([example[1] for example in training_examples],
+                           dtype=dtype)
+        num_examples = len(training_examples)
+        # split the examples into full batches, plus one partial batch
+        #    for any examples left over
+        num_full = num_examples - num_examples % batch_size
+        batch_bounds = [(start, start+batch_size)
+                        for start in range(0, num_full, batch_size)]
+        if num_full < num_examples:
+            batch_bounds.append((num_full, num_examples))
+        # allocate the buffers for the batches once, and then write every
+        #    intermediate result into them, rather than into new arrays
+        buffers = [layer.allocate_buffers(batch_size, dtype, xp)
+                   for layer in layers]
+        # the last weight and threshold changes of each layer, for momentum
+        velocities = [(xp.zeros_like(W), xp.zeros_like(b)) for W, b in params]
+        order = list(range(num_examples))
+        if unsupervised:
+            # see train for an explanation of the sparse autoencoder
+            rho = 0.05
+            rho_estimates = [xp.zeros(len(layer.neurons))
+                             for layer in layers]
+            beta = 0.2
+        lr = self.learning_rate
+        mom = self.momentum_coef
+        for _ in range(iterations):
+            random.shuffle(order)
+            # gather the shuffled examples once per iteration, so that each
+            #    batch is just a contiguous slice
+            shuffled_order = xp.asarray(order)
+            shuffled_inputs = inputs[shuffled_order]
+            shuffled_targets = targets[shuffled_order]
+            for start, stop in batch_bounds:
+                n = stop - start
+                X = shuffled_inputs[start:stop]
+                Y = shuffled_targets[start:stop]
+                step = lr / n
+                # forward pass, keeping the input to each layer
+                layer_inputs = []
+                for (W, b), (Z, A, _, _, _), activate in zip(forward_arrays,
+                                                             buffers,
+                                                             activations):
+                    layer_inputs.append(X)
+                    Z = np.dot(X, W.T, out=Z[:n])
+                    Z += b
+                    X = activate(Z, out=A[:n])
+                # output layer delta
+                D = output_delta(X, Y, out=buffers[-1][2][:n])
+                # move backwards through the layers, updating this layer's
+                #    weights before computing the delta of the previous layer
+                #    with them (as in train)
+                for l in range(len(layers)-1, -1, -1):
+                    W, b = params[l]
+                    V_W, V_b = velocities[l]
+                    _, _, _, dW, db = buffers[l]
+                    A_prev = layer_inputs[l]
+                    np.dot(D.T, A_prev, out=dW)
+                    dW *= step
+                    V_W *= mom
+                    V_W += dW
+                    W -= V_W
+                    np.sum(D, axis=0, out=db)
+                    db *= step
+                    V_b *= mom
+                    V_b += db
+                    b -= V_b
+                    if unsupervised and l < len(layers)-1:
+                        _update_sparsity(rho_estimates[l],
+                                         layer_inputs[l+1].mean(axis=0), b,
+                                         lr * beta, rho, n)
+                    if forward_dtype is not None:
+                        # refresh the lower precision copies
+                        forward_arrays[l][0][:] = W
+                        forward_arrays[l][1][:] = b
+                    if l > 0:
+                        # Note: the net inputs of the previous layer are no
+                        #    longer needed, so that buffer is reused here
+                        Z_prev, _, D_prev, _, _ = buffers[l-1]
+                        D = np.dot(D, forward_arrays[l][0], out=D_prev[:n])
+                        D *= derivatives[l-1](A_prev, out=Z_prev[:n])
+        if iterations > 0:
+            # keep the activations from the last example in each layer
+            #    -Note: this is done once, after training, since on the gpu
+            #        each of these is a copy back to the host
+            for (_, _, a), A in zip(arrays, layer_inputs[1:] + [X]):
+                a[:] = to_numpy(A[-1])
+        if xp is not np:
+            # copy the trained parameters back from the gpu
+            for (W, b, _), (W_gpu, b_gpu) in zip(arrays, params):
+                W[:] = to_numpy(W_gpu)
+                b[:] = to_numpy(b_gpu)
+        self.iterations = iterations
+
+    def train_compiled(self, network, training_examples, iterations,
+                       unsupervised=False):
+        """Compiled version of train, which performs the same training
+        algorithm one example at a time, but on the arrays of each layer
+        (see Layer.as_arrays) using a Numba-compiled training step that is
+        specialized for the topology of the network (see
+        pine.kernels.training_step)
+
+        If Numba is not installed, the training step runs as plain Python
+
+        """
+        # imported here, so that Numba is only loaded when it is needed
+        import pine.kernels as kernels
+        layers = network.layers
+        arrays = [layer.as_arrays() for layer in layers]
+        deltas = [np.empty_like(b) for _, b, _ in arrays]
+        act_ids = [kernels.ACTIVATION_IDS[layer.activation_function.name]
+                   for layer in layers]
+        topology = tuple((W.shape[1], W.shape[0], act_id)
+                         for (W, _, _), act_id in zip(arrays, act_ids))
+        step = kernels.training_step(topology)
+        # the last weight and threshold changes of each layer, for momentum
+        velocities = [(np.zeros_like(W), np.zeros_like(b))
+                      for W, b, _ in arrays]
+        layer_args = [array for (W, b, a), d, (V_W, V_b)
+                      in zip(arrays, deltas, velocities)
+                      for array in (W, b, a, d, V_W, V_b)]
+        inputs = np.array([example[0] for example in training_examples],
+                          dtype=float)
+        targets = np.array([example[1] for example in training_examples],
+                           dtype=float)
+        order = list(range(len(training_examples)))
+        if unsupervised:
+            # see train for an explanation of the sparse autoencoder
+            rho = 0.05
+            rho_estimates = [np.zeros(len(layer.neurons))
+                             for layer in layers]
+            beta = 0.2
+        lr = self.learning_rate
+        mom = self.momentum_coef
+        for _ in range(iterations):
+            random.shuffle(order)
+            for index in order:
+                step(inputs[index], targets[index], lr, mom, *layer_args)
+                if unsupervised:
+                    # the threshold updates do not affect the deltas, so
+                    #    these can be done after the rest of the step
+                    for (_, b, a), estimates in zip(arrays[-2::-1],
+                                                    rho_estimates[-2::-1]):
+                        _update_sparsity(estimates, a, b, lr * beta, rho)
+        self.iterations = iterations
+
+
+def _update_sparsity(rho_estimates, activations, thresholds, step, rho,
+                     num_examples=1):
+    """Update the running estimates of the average activation of each hidden
+    neuron of a sparse autoencoder, and nudge the thresholds so that the
+    estimates move towards rho, all in place
+
+        rho_estimates = 0.999*rho_estimates + 0.001*activations
+        thresholds -= step * (rho_estimates - rho)
+
+    For a batch of num_examples examples, activations are the mean
+        activations of the batch, and the update approximates num_examples
+        consecutive updates, by decaying the estimates num_examples times,
+        and nudging the thresholds num_examples times as far:
+
+        decay = 0.999**num_examples
+        rho_estimates = decay*rho_estimates + (1 - decay)*activations
+        thresholds -= num_examples * step * (rho_estimates - rho)
+
+    """
+    decay = 0.999**num_examples
+    rho_estimates *= decay
+    rho_estimates += (1.0 - decay) * activations
+    thresholds -= (num_examples * step) * (rho_estimates - rho)
+
+
+# The process pool used by parallel_train, which is kept between calls to
+#    avoid starting new processes each time, along with the shared memory
+#    block its workers are attached to, and the (number of processes,
+#    layout, activation function names) it was created for
+_pool = None
+_pool_shm = None
+_pool_key = None
 
 
 def parallel_train(network, trainer, training_examples, iterations,
@@ -205,6 +518,11 @@ def parallel_train(network, trainer, training_examples, iterations,
 
     This will ultimately change the weights in the given network
 
+    The worker processes are kept in a pool that is reused by later calls
+        for a network with the same layout and number of processes, unless
+        the training fails (e.g. a worker process dies), in which case the
+        pool is shut down so that the next call starts a new one
+
     """
     if num_processes is None:
         # Determine the number of processes
@@ -214,94 +532,194 @@ def parallel_train(network, trainer, training_examples, iterations,
         #    possible number of processes, so reduce the number of processes
         #    used
         num_processes = len(training_examples)
+    # this process counts as one of the processes
+    num_workers = num_processes - 1
+    if num_workers < 1:
+        trainer.train(network, training_examples, iterations, unsupervised)
+        return
+
+    # Get the pool of worker processes, along with the shared memory used to
+    #    pass the network parameters to and from them, so that the network
+    #    itself never needs to be sent between processes
+    #    -each process has its own contiguous region of the block, holding
+    #        the weights and thresholds of every layer at known offsets
+    #    -the worker regions start out with this network's parameters
+    offsets, region_size = _parameter_offsets(network)
+    pool, shm = _get_pool(network, num_processes)
+    regions = np.ndarray((num_processes, region_size), buffer=shm.buf)
+    for process_num in range(num_workers):
+        _store_parameters(network, regions[process_num], offsets)
 
-    # Create the return queue to store the training networks that are returned
-    #    from each process
-    results_queue = Queue() # this is the multiprocessing queue
-
-    # Train the training networks on a subset of the data
-    #    -this is where the parallelization will occur
-    #    -To get the training data subset for each process:
-    #        -chunk the examples up into the correct number for the
-    #            number of processes, and take each chunk
-    #    -Note: when this process is created, a copy of any object that is
-    #        accessed will be made, so no need to make a copy of the given
-    #        network first
-    chunk_amount = int(len(training_examples)/num_processes)
-    jobs = [Process(target=_parallel_train_worker,
-                    args=(network, trainer,
-                          training_examples[process_num*chunk_amount:
-                                            (process_num*chunk_amount)+
-                                            chunk_amount],
-                          iterations, results_queue, True, unsupervised))
-                    for process_num in range(num_processes-1)]
-    # start the processes
-    for job in jobs: job.start()
-
-    # while those processes are running, perform this process's work as well
-    #    -Note: this process counts as one of the processes, so set to the
-    #        last process number possible
-    #    -Note: no need to copy this network onto the Queue (that would be
-    #        redundant
-    start_index = int((num_processes-1)*chunk_amount)
-    _parallel_train_worker(network, trainer,
-                           training_examples[start_index:
-                                             start_index+chunk_amount],
-                           iterations, results_queue, False, unsupervised)
-
-    # retrieve the trained networks as they come in
-    #    -Note: this is necessary because the multiprocess Queue is actually
-    #        a pipe, and has a maximum size limit.  Therefore, it will not 
-    #        work unless these are pulled from the other end
-    #    -Note: the get() will, by default, wait until there is an item ready
-    #        with no timeout
-    trained_networks = [results_queue.get() for _ in range(num_processes-1)]
-
-    # now wait for the other processes to finish
-    for job in jobs: job.join()
+    try:
+        # Train the training networks on a subset of the data
+        #    -this is where the parallelization will occur
+        #    -To get the training data subset for each process:
+        #        -chunk the examples up into the correct number for the
+        #            number of processes, and take each chunk
+        chunk_amount = int(len(training_examples)/num_processes)
+        jobs = [pool.submit(_parallel_train_worker, trainer,
+                            training_examples[process_num*chunk_amount:
+                                              (process_num*chunk_amount)+
+                                              chunk_amount],
+                            iterations, process_num, unsupervised)
+                for process_num in range(num_workers)]
+
+        # while those processes are running, perform this process's work as
+        #    well, directly on the given network
+        #    -Note: this process counts as one of the processes, so set to
+        #        the last process number possible
+        start_index = int(num_workers*chunk_amount)
+        trainer.train(network,
+                      training_examples[start_index:start_index+chunk_amount],
+                      iterations, unsupervised)
+        _store_parameters(network, regions[num_workers], offsets)
+
+        # now wait for the other processes to finish
+        #    -Note: result() will also raise any error from the worker
+        for job in jobs: job.result()
+    except BaseException:
+        # a worker that failed (or died, which breaks the whole pool) may
+        #    have left the pool unusable, so shut it down, so that the next
+        #    call starts a new one
+        #    -Note: the view of the shared memory must be released first
+        del regions
+        _shutdown_pool()
+        raise
 
     # now average out the training networks into the master network
     #    by averaging the weights and threshold values
-    for l, layer in enumerate(network.layers):
-        for j, neuron in enumerate(layer.neurons):
-            # average out weights
-            for ij in range(len(neuron.weights)):
-                weight_sum = 0.0
-                for trained_network in trained_networks:
-                    weight_sum += trained_network.layers[l].neurons[j].weights[ij]
-                neuron.weights[ij] = (neuron.weights[ij]+weight_sum)/(len(trained_networks)+1)
-            # average out thresholds
-            threshold_sum = 0.0
-            for trained_network in trained_networks:
-                    threshold_sum += trained_network.layers[l].neurons[j].threshold
-            neuron.threshold = (neuron.threshold+threshold_sum)/(len(trained_networks)+1)
-
-
-def _parallel_train_worker(network, trainer, training_examples,
-                           iterations, results_queue,
-                           return_results_on_queue=True, unsupervised=False):
-    """This private function is run by a parallel process to train the
+    #    -the regions stack up into one array, so this is a single mean
+    #        per array, written straight into the network's arrays
+    for layer, (W_slice, b_slice) in zip(network.layers, offsets):
+        W, b, _ = layer.as_arrays()
+        np.mean(regions[:, W_slice], axis=0, out=W.reshape(-1))
+        np.mean(regions[:, b_slice], axis=0, out=b)
+
+
+def _get_pool(network, num_processes):
+    """Return the process pool and shared memory block for training the given
+    network with the given number of processes, creating them if the
+    existing ones were made for a different layout or number of processes
+
+    """
+    global _pool, _pool_shm, _pool_key
+    # the layout of the network, from which the workers can rebuild it
+    layout = ([len(network.layers[0].neurons[0].weights)] +
+              [len(layer.neurons) for layer in network.layers])
+    activation_function_names = [layer.activation_function.name
+                                 for layer in network.layers]
+    key = (num_processes, layout, activation_function_names)
+    if key != _pool_key:
+        _shutdown_pool()
+        _, region_size = _parameter_offsets(network)
+        _pool_shm = SharedMemory(create=True,
+                                 size=8*region_size*num_processes)
+        _pool = ProcessPoolExecutor(num_processes-1,
+                                    initializer=_init_parallel_train_worker,
+                                    initargs=(layout,
+                                              activation_function_names,
+                                              _pool_shm.name, num_processes))
+        _pool_key = key
+    return _pool, _pool_shm
+
+
+def _shutdown_pool():
+    """Shut down the process pool used by parallel_train, if any, and free
+    its shared memory
+
+    """
+    global _pool, _pool_shm, _pool_key
+    if _pool is not None:
+        _pool.shutdown()
+        _pool_shm.close()
+        _pool_shm.unlink()
+    _pool = None
+    _pool_shm = None
+    _pool_key = None
+
+atexit.register(_shutdown_pool)
+
+
+# The state of a worker process in the pool (see _init_parallel_train_worker)
+_worker_network = None
+_worker_shm = None
+_worker_regions = None
+
+
+def _init_parallel_train_worker(layout, activation_function_names,
+                                shared_name, num_processes):
+    """This private function is run once by each process in the pool to
+    build its network from the given layout and activation functions, and
+    attach to the shared memory block named shared_name
+
+    """
+    global _worker_network, _worker_shm, _worker_regions
+    _worker_network = pine.util.create_network(layout,
+                                               activation_function_names)
+    _, region_size = _parameter_offsets(_worker_network)
+    _worker_shm = SharedMemory(name=shared_name)
+    _worker_regions = np.ndarray((num_processes, region_size),
+                                 buffer=_worker_shm.buf)
+
+
+def _parallel_train_worker(trainer, training_examples, iterations,
+                           process_num, unsupervised=False):
+    """This private function is run by a process in the pool to train its
     network on a given subset of the training data
 
-    Note: Only processes OTHER than the main one will want to return the
-        resulting network in the queue.  The main process will just be
-        editing its network
+    The network parameters are loaded from the given process's region of the
+        shared memory block, and once trained, stored back in the same
+        region for the main process to average
+
+    """
+    offsets, _ = _parameter_offsets(_worker_network)
+    region = _worker_regions[process_num]
+    _load_parameters(_worker_network, region, offsets)
+    trainer.train(_worker_network, training_examples, iterations,
+                  unsupervised)
+    _store_parameters(_worker_network, region, offsets)
+
+
+def _parameter_offsets(network):
+    """Return the slices of the weights and thresholds of each layer within
+    a flat vector of all the network's parameters, and the size of it
 
     """
-    trainer.train(network, training_examples, iterations, unsupervised)
-    if return_results_on_queue:
-        # return this trained network back to the main process by placing it 
-        #    on the queue
-        results_queue.put(network)
+    offsets = []
+    start = 0
+    for layer in network.layers:
+        W, b, _ = layer.as_arrays()
+        W_slice = slice(start, start+W.size)
+        b_slice = slice(W_slice.stop, W_slice.stop+b.size)
+        offsets.append((W_slice, b_slice))
+        start = b_slice.stop
+    return offsets, start
+
+
+def _store_parameters(network, vector, offsets):
+    """Copy the network's weights and thresholds into the flat vector"""
+    for layer, (W_slice, b_slice) in zip(network.layers, offsets):
+        W, b, _ = layer.as_arrays()
+        vector[W_slice] = W.reshape(-1)
+        vector[b_slice] = b
+
+
+def _load_parameters(network, vector, offsets):
+    """Copy the weights and thresholds in the flat vector into the network"""
+    for layer, (W_slice, b_slice) in zip(network.layers, offsets):
+        W, b, _ = layer.as_arrays()
+        W.reshape(-1)[:] = vector[W_slice]
+        b[:] = vector[b_slice]
 
 
 def sign(x):
-    """Return the sign (-1, 0, 1) of x"""
-    if x < 0.0:
-        sign = -1
-    elif x == 0.0:
-        sign = 0
-    elif x > 0.0:
-        sign = 1
-    return sign
+    """Return the sign (-1, 0, 1) of x
+
+    Note: NaN has no sign, so 0 is returned for it
+
+    """
+    # subtracting the two comparisons (as ints, since NumPy bools cannot be
+    #    subtracted) gives the sign without any branches -> for arrays, use
+    #    np.sign instead
+    return int(x > 0.0) - int(x < 0.0)
 
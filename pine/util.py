@@ -101,8 +101,8 @@ def print_network_error(network, training_data, testing_data):
 def print_network_outputs(network, testing_data):
     """Print the given network's outputs on the test data"""
     for i in range(len(testing_data)):
-        outputs = network.forward(testing_data[i][1])
+        outputs = network.forward(testing_data[i][0])
         print('Input: {0}, Target Output: {1}, Actual Output: {2}'.
-              format(testing_data[i][1], testing_data[i][0],
+              format(testing_data[i][0], testing_data[i][1],
                      outputs))
 
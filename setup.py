@@ -8,6 +8,7 @@ setup(name='Pine',
       author='Mike Dusenberry',
       url='https://github.com/dusenberrymw/Pine',
       packages=['pine'],
+      install_requires=['numpy'],
      )
 
 shutil.rmtree('dist')
@@ -4,15 +4,24 @@ Created on Sept 9, 2014
 
 @author: dusenberrymw
 '''
+import contextlib
+import copy
+import io
 import math
 import os
+import pickle
+import random
 import sys
 import unittest
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy
 
 sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
 
 # import pine.data
 import pine.activation
+import pine.kernels
 import pine.network
 import pine.trainer
 import pine.util
@@ -48,12 +57,19 @@ class TestNetwork(unittest.TestCase):
         new_neuron.weights = [1,-2]
         new_neuron.threshold = 4
         new_layer = pine.network.Layer()
-        new_layer.neurons = [self.neuron]
+        new_layer.neurons = [new_neuron]
         network.layers.append(new_layer)
-        local_output = sum([x*y for x,y in zip([self.output, self.output], self.neuron.weights)]) + self.neuron.threshold
+        local_output = sum([x*y for x,y in zip([self.output, self.output], new_neuron.weights)]) + new_neuron.threshold
         out = [1.0 / (1 + math.exp(-1.0*local_output))]
         self.assertEqual(network.forward(self.input_vector), out) #0.9525741275104728
 
+    def test_network_forward_wrong_inputs(self):
+        network = pine.util.create_network([3,5,2], ['logistic']*2)
+        with self.assertRaises(ValueError) as context:
+            network.forward([1,2])
+        self.assertEqual(str(context.exception), "layer 0: layer of 5 "
+                         "neurons expects 3 inputs, but was given 2")
+
     def test_neuron_backward(self):
         self.neuron.forward(self.input_vector)
         self.neuron.output = 2
@@ -111,6 +127,63 @@ class TestNetwork(unittest.TestCase):
                 # print("t difference: {}".format(diff))
                 neuron.threshold = old_theta
 
+    def test_layer_arrays(self):
+        network = pine.util.create_network([3,5,2], ['logistic']*2)
+        layer = network.layers[0]
+        W, b, a = layer.as_arrays()
+        self.assertEqual(W.shape, (5,3))
+        self.assertTrue(W.flags['C_CONTIGUOUS'])
+        # the neurons' values live in the layer's arrays
+        layer.neurons[1].weights[2] = 0.5
+        layer.neurons[1].threshold = 0.25
+        self.assertEqual(W[1,2], 0.5)
+        self.assertEqual(b[1], 0.25)
+        W[3,0] = -0.5
+        self.assertEqual(layer.neurons[3].weights[0], -0.5)
+        network.forward(self.input_vector)
+        self.assertEqual(list(a), [n.output for n in layer.neurons])
+        # and stay shared once copied
+        network2 = pickle.loads(pickle.dumps(network))
+        layer2 = network2.layers[0]
+        layer2.neurons[1].weights[0] = 0.75
+        self.assertEqual(layer2.as_arrays()[0][1,0], 0.75)
+
+    def test_layer_neurons_read_only(self):
+        layer = pine.util.create_layer(2, 3, 'logistic')
+        new_neuron = pine.util.create_neuron(3, 'logistic')
+        with self.assertRaises(AttributeError):
+            layer.neurons.append(new_neuron)
+        layer.neurons = list(layer.neurons) + [new_neuron]
+        self.assertEqual(layer.as_arrays()[0].shape, (3,3))
+        self.assertEqual(len(layer.forward(self.input_vector)), 3)
+
+    def test_unpickle_old_layer(self):
+        # a layer pickled before the arrays existed only has its neurons,
+        #    each with its own weights list, threshold, and output
+        old_neuron = pine.network.Neuron.__new__(pine.network.Neuron)
+        old_neuron.__dict__.update({'input_vector': [0]*3, 'output': 0.0,
+                                    'activation_function': self.act_func,
+                                    'weights': [1,-2,3], 'threshold': 4,
+                                    'weight_gradients': [0]*3,
+                                    'threshold_gradient': 0})
+        old_layer = pine.network.Layer.__new__(pine.network.Layer)
+        old_layer.__dict__['neurons'] = [old_neuron]
+        layer = pickle.loads(pickle.dumps(old_layer))
+        W, b, _ = layer.as_arrays()
+        self.assertEqual(W.tolist(), [[1,-2,3]])
+        self.assertEqual(b.tolist(), [4])
+        self.assertEqual(layer.forward(self.input_vector), [self.output])
+
+    def test_allocate_buffers(self):
+        layer = pine.util.create_layer(5, 3, 'logistic')
+        buffers = layer.allocate_buffers(4)
+        self.assertEqual([buf.shape for buf in buffers],
+                         [(4,5), (4,5), (4,5), (5,3), (5,)])
+        # reused for smaller batches, but not larger ones
+        self.assertIs(layer.allocate_buffers(2), buffers)
+        self.assertIsNot(layer.allocate_buffers(8), buffers)
+        self.assertNotIn('_buffers', pickle.loads(pickle.dumps(layer)).__dict__)
+
     def test_reset_gradients(self):
         network = pine.util.create_network([3,5,2], ['logistic']*2)
         for layer in network.layers:
@@ -123,6 +196,272 @@ class TestNetwork(unittest.TestCase):
         pass
 
 
+# trainer.py
+class TestTrainer(unittest.TestCase):
+    """Testing for trainer.py"""
+    def setUp(self):
+        self.examples = [[[0,0],[0]], [[0,1],[1]], [[1,0],[1]], [[1,1],[0]]]
+
+    def test_train_iterations(self):
+        network = pine.util.create_network([2,4,1], ['tanh', 'logistic'])
+        trainer = pine.trainer.Backpropagation(0.1, 0)
+        for train in (trainer.train, trainer.train_vectorized,
+                      trainer.train_compiled):
+            train(network, self.examples, 3)
+            self.assertEqual(trainer.iterations, 3)
+            arrays = [[array.copy() for array in layer.as_arrays()]
+                      for layer in network.layers]
+            train(network, self.examples, 0)
+            self.assertEqual(trainer.iterations, 0)
+            for layer, layer_arrays in zip(network.layers, arrays):
+                for array, array2 in zip(layer.as_arrays(), layer_arrays):
+                    self.assertTrue(numpy.array_equal(array, array2))
+
+    def test_train_vectorized_matches_train(self):
+        # with a batch_size of 1, both trainers perform identical updates
+        network = pine.util.create_network([2,5,4,3],
+                                           ['tanh', 'logistic', 'tanh'])
+        network2 = copy.deepcopy(network)
+        examples = [[x, y*3] for x, y in self.examples] # 3 outputs
+        trainer = pine.trainer.Backpropagation(0.1, 0)
+        random.seed(2)
+        trainer.train(network, copy.deepcopy(examples), 5)
+        random.seed(2)
+        trainer.train_vectorized(network2, copy.deepcopy(examples), 5)
+        for layer, layer2 in zip(network.layers, network2.layers):
+            for neuron, neuron2 in zip(layer.neurons, layer2.neurons):
+                for w, w2 in zip(neuron.weights, neuron2.weights):
+                    self.assertAlmostEqual(w, w2)
+                self.assertAlmostEqual(neuron.threshold, neuron2.threshold)
+
+    def test_train_momentum(self):
+        # with momentum, all three trainers perform identical updates
+        network = pine.util.create_network([2,5,3], ['logistic', 'tanh'])
+        examples = [[x, y*3] for x, y in self.examples] # 3 outputs
+        trainer = pine.trainer.Backpropagation(0.1, 0.5)
+        networks = []
+        for train in (trainer.train, trainer.train_vectorized,
+                      trainer.train_compiled):
+            networks.append(copy.deepcopy(network))
+            random.seed(2)
+            train(networks[-1], copy.deepcopy(examples), 5)
+        for other in networks[1:]:
+            for layer, layer2 in zip(networks[0].layers, other.layers):
+                W, b, _ = layer.as_arrays()
+                W2, b2, _ = layer2.as_arrays()
+                self.assertTrue(numpy.allclose(W, W2))
+                self.assertTrue(numpy.allclose(b, b2))
+        # and momentum changes the updates
+        network2 = copy.deepcopy(network)
+        random.seed(2)
+        pine.trainer.Backpropagation(0.1, 0).train(network2,
+                                                   copy.deepcopy(examples), 5)
+        self.assertFalse(numpy.allclose(networks[0].layers[0].as_arrays()[0],
+                                        network2.layers[0].as_arrays()[0]))
+
+    def test_train_vectorized_lowers_cost(self):
+        random.seed(1)
+        network = pine.util.create_network([2,5,1], ['logistic']*2)
+        cost = pine.util.calculate_average_cost(network, self.examples)
+        trainer = pine.trainer.Backpropagation(0.5, 0)
+        trainer.train_vectorized(network, self.examples, 200)
+        new_cost = pine.util.calculate_average_cost(network, self.examples)
+        self.assertLess(new_cost, cost)
+
+    def test_train_vectorized_mini_batches(self):
+        # 4 examples in batches of 3 leaves a partial batch of 1
+        random.seed(1)
+        network = pine.util.create_network([2,5,1], ['logistic']*2)
+        cost = pine.util.calculate_average_cost(network, self.examples)
+        trainer = pine.trainer.Backpropagation(0.5, 0)
+        trainer.train_vectorized(network, self.examples, 200, batch_size=3)
+        new_cost = pine.util.calculate_average_cost(network, self.examples)
+        self.assertLess(new_cost, cost)
+
+    def test_train_vectorized_forward_dtype(self):
+        network = pine.util.create_network([2,4,1], ['tanh', 'logistic'])
+        network2 = copy.deepcopy(network)
+        trainer = pine.trainer.Backpropagation(0.1, 0)
+        random.seed(4)
+        trainer.train_vectorized(network, copy.deepcopy(self.examples), 5)
+        random.seed(4)
+        trainer.train_vectorized(network2, copy.deepcopy(self.examples), 5,
+                                 forward_dtype=numpy.float32)
+        for layer, layer2 in zip(network.layers, network2.layers):
+            W, b, _ = layer2.as_arrays()
+            self.assertEqual(W.dtype, numpy.float64) # still full precision
+            self.assertTrue(numpy.allclose(layer.as_arrays()[0], W,
+                                           atol=1e-5))
+            self.assertTrue(numpy.allclose(layer.as_arrays()[1], b,
+                                           atol=1e-5))
+
+    def test_train_no_examples(self):
+        network = pine.util.create_network([2,4,1], ['tanh', 'logistic'])
+        weights = [layer.as_arrays()[0].copy() for layer in network.layers]
+        trainer = pine.trainer.Backpropagation(0.1, 0)
+        for train in (trainer.train, trainer.train_vectorized,
+                      trainer.train_compiled):
+            train(network, [], 2)
+            self.assertEqual(trainer.iterations, 2)
+        for layer, W in zip(network.layers, weights):
+            self.assertTrue(numpy.array_equal(layer.as_arrays()[0], W))
+
+    @unittest.skipIf(pine.trainer.cupy is not None, "CuPy is installed")
+    def test_train_vectorized_gpu_requires_cupy(self):
+        network = pine.util.create_network([2,4,1], ['tanh', 'logistic'])
+        trainer = pine.trainer.Backpropagation(0.1, 0)
+        self.assertRaises(ValueError, trainer.train_vectorized, network,
+                          self.examples, 5, device='gpu')
+        self.assertRaises(ValueError, trainer.train_vectorized, network,
+                          self.examples, 5, device='tpu')
+
+    def test_train_compiled_matches_train_vectorized(self):
+        network = pine.util.create_network([2,4,2], ['tanh', 'logistic'])
+        network2 = copy.deepcopy(network)
+        examples = [[x, y*2] for x, y in self.examples] # 2 outputs
+        trainer = pine.trainer.Backpropagation(0.1, 0)
+        random.seed(3)
+        trainer.train_vectorized(network, copy.deepcopy(examples), 5)
+        random.seed(3)
+        trainer.train_compiled(network2, copy.deepcopy(examples), 5)
+        for layer, layer2 in zip(network.layers, network2.layers):
+            for neuron, neuron2 in zip(layer.neurons, layer2.neurons):
+                for w, w2 in zip(neuron.weights, neuron2.weights):
+                    self.assertAlmostEqual(w, w2)
+                self.assertAlmostEqual(neuron.threshold, neuron2.threshold)
+
+    def test_train_compiled_matches_train_vectorized_unsupervised(self):
+        # sparse autoencoder
+        examples = [[x, x] for x, _ in self.examples]
+        network = pine.util.create_network([2,3,2], ['logistic']*2)
+        network2 = copy.deepcopy(network)
+        trainer = pine.trainer.Backpropagation(0.1, 0)
+        random.seed(5)
+        trainer.train_vectorized(network, copy.deepcopy(examples), 5, True)
+        random.seed(5)
+        trainer.train_compiled(network2, copy.deepcopy(examples), 5, True)
+        for layer, layer2 in zip(network.layers, network2.layers):
+            for array, array2 in zip(layer.as_arrays(), layer2.as_arrays()):
+                self.assertTrue(numpy.allclose(array, array2))
+
+    def test_train_unsupervised_hidden_layers(self):
+        # sparse autoencoder with two hidden layers of different sizes,
+        #    which keep separate estimates
+        examples = [[x*2, x*2] for x, _ in self.examples]
+        network = pine.util.create_network([4,5,3,4], ['logistic']*3)
+        trainer = pine.trainer.Backpropagation(0.1, 0)
+        networks = []
+        for train in (trainer.train, trainer.train_vectorized,
+                      trainer.train_compiled):
+            networks.append(copy.deepcopy(network))
+            random.seed(6)
+            train(networks[-1], copy.deepcopy(examples), 5, True)
+        for other in networks[1:]:
+            for layer, layer2 in zip(networks[0].layers, other.layers):
+                for array, array2 in zip(layer.as_arrays(),
+                                         layer2.as_arrays()):
+                    self.assertTrue(numpy.allclose(array, array2))
+
+    def test_update_sparsity_batch(self):
+        # a batch of identical examples decays the estimates as much as
+        #    updating with each example in turn
+        activations = numpy.array([0.2, 0.7])
+        estimates = numpy.array([0.5, 0.1])
+        thresholds = numpy.zeros(2)
+        estimates2 = estimates.copy()
+        thresholds2 = thresholds.copy()
+        for _ in range(4):
+            pine.trainer._update_sparsity(estimates, activations, thresholds,
+                                          0.01, 0.05)
+        pine.trainer._update_sparsity(estimates2, activations, thresholds2,
+                                      0.01, 0.05, 4)
+        self.assertTrue(numpy.allclose(estimates, estimates2))
+        self.assertTrue(numpy.allclose(thresholds, thresholds2, atol=1e-4))
+
+    def test_training_step_cached(self):
+        topology = ((2, 4, pine.kernels.TANH), (4, 1, pine.kernels.LOGISTIC))
+        step = pine.kernels.training_step(topology)
+        self.assertIs(pine.kernels.training_step(topology), step)
+        self.assertIsNot(pine.kernels.training_step(topology[:1]), step)
+
+    def test_parallel_train(self):
+        # use OR, since the average of separately trained XOR networks is
+        #    not guaranteed to be any better
+        examples = [[x, [float(any(x))]] for x, _ in self.examples]
+        random.seed(1)
+        network = pine.util.create_network([2,5,1], ['logistic']*2)
+        cost = pine.util.calculate_average_cost(network, examples)
+        trainer = pine.trainer.Backpropagation(0.5, 0)
+        pine.trainer.parallel_train(network, trainer, examples*4, 50,
+                                    num_processes=2)
+        new_cost = pine.util.calculate_average_cost(network, examples)
+        self.assertLess(new_cost, cost)
+
+    def test_parallel_train_averages(self):
+        # with no learning, every process ends with the original weights,
+        #    so their average must be unchanged
+        network = pine.util.create_network([2,5,1], ['logistic']*2)
+        network2 = copy.deepcopy(network)
+        trainer = pine.trainer.Backpropagation(0, 0)
+        pine.trainer.parallel_train(network, trainer, self.examples, 2,
+                                    num_processes=3)
+        for layer, layer2 in zip(network.layers, network2.layers):
+            for array, array2 in zip(layer.as_arrays()[:2],
+                                     layer2.as_arrays()[:2]):
+                self.assertTrue(numpy.allclose(array, array2))
+
+    def test_parallel_train_reuses_pool(self):
+        network = pine.util.create_network([2,3,1], ['logistic']*2)
+        trainer = pine.trainer.Backpropagation(0.5, 0)
+        pine.trainer.parallel_train(network, trainer, self.examples, 1,
+                                    num_processes=2)
+        pool = pine.trainer._pool
+        pine.trainer.parallel_train(network, trainer, self.examples, 1,
+                                    num_processes=2)
+        self.assertIs(pine.trainer._pool, pool)
+        # a different layout needs a new pool
+        network = pine.util.create_network([2,4,1], ['logistic']*2)
+        pine.trainer.parallel_train(network, trainer, self.examples, 1,
+                                    num_processes=2)
+        self.assertIsNot(pine.trainer._pool, pool)
+
+    def test_parallel_train_dead_worker(self):
+        network = pine.util.create_network([2,3,1], ['logistic']*2)
+        trainer = _ExitingTrainer(0.5, 0)
+        with self.assertRaises(BrokenProcessPool):
+            pine.trainer.parallel_train(network, trainer, self.examples, 1,
+                                        num_processes=2)
+        self.assertIsNone(pine.trainer._pool)
+        # the next call starts a new pool
+        trainer = pine.trainer.Backpropagation(0.5, 0)
+        pine.trainer.parallel_train(network, trainer, self.examples, 1,
+                                    num_processes=2)
+
+    def test_sign(self):
+        self.assertEqual(pine.trainer.sign(-2.5), -1)
+        self.assertEqual(pine.trainer.sign(0.0), 0)
+        self.assertEqual(pine.trainer.sign(3), 1)
+        self.assertEqual(pine.trainer.sign(float('nan')), 0)
+        self.assertEqual(pine.trainer.sign(numpy.float64(2.0)), 1)
+        self.assertEqual(pine.trainer.sign(numpy.float32(-0.5)), -1)
+        self.assertEqual(pine.trainer.sign(numpy.float64('nan')), 0)
+
+    def tearDown(self):
+        pass
+
+
+class _ExitingTrainer(pine.trainer.Backpropagation):
+    """Trainer that kills any worker process that it is used in"""
+    def __init__(self, learning_rate, momentum_coef):
+        super().__init__(learning_rate, momentum_coef)
+        self.parent_pid = os.getpid()
+
+    def train(self, *args, **kwargs):
+        if os.getpid() != self.parent_pid:
+            os._exit(1)
+        super().train(*args, **kwargs)
+
+
 # util.py
 class TestUtil(unittest.TestCase):
     """Testing for util"""
@@ -133,16 +472,75 @@ class TestUtil(unittest.TestCase):
         self.assertTrue(pine.util.is_valid_function("logistic"))
         self.assertFalse(pine.util.is_valid_function("test"))
 
+    def test_print_network_outputs(self):
+        network = pine.util.create_network([2,3,1], ['logistic']*2)
+        testing_data = [[[0,1],[1]], [[1,1],[0]]]
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            pine.util.print_network_outputs(network, testing_data)
+        lines = output.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        for line, (input_vector, target) in zip(lines, testing_data):
+            self.assertEqual(line, 'Input: {0}, Target Output: {1}, Actual '
+                             'Output: {2}'.format(input_vector, target,
+                                                  network.forward(input_vector)))
+
     def tearDown(self):
         pass
 
 class TestActivation(unittest.TestCase):
     """Testing for activation"""
     def setUp(self):
-        pass
+        self.act_funcs = [pine.activation.Logistic(), pine.activation.Tanh(),
+                          pine.activation.Linear()]
+        self.inputs = [-3.5, -0.2, 0.0, 0.7, 4.1]
 
-    def test_METHOD(self):
-        pass
+    def test_activate_vec(self):
+        for act_func in self.act_funcs:
+            outputs = act_func.activate_vec(numpy.array(self.inputs))
+            for x, fx in zip(self.inputs, outputs):
+                self.assertAlmostEqual(fx, act_func.activate(x))
+            # integer input
+            outputs = act_func.activate_vec(numpy.array([-2, 0, 3]))
+            for x, fx in zip([-2, 0, 3], outputs):
+                self.assertAlmostEqual(fx, act_func.activate(x))
+
+    def test_activate_vec_in_place(self):
+        for act_func in self.act_funcs:
+            array = numpy.array(self.inputs)
+            expected = act_func.activate_vec(numpy.array(self.inputs))
+            self.assertIs(act_func.activate_vec(array, out=array), array)
+            self.assertTrue(numpy.array_equal(array, expected))
+
+    def test_derivative_vec(self):
+        for act_func in self.act_funcs:
+            outputs = act_func.activate_vec(numpy.array(self.inputs))
+            derivatives = act_func.derivative_vec(outputs)
+            self.assertEqual(derivatives.shape, outputs.shape)
+            for fx, dfx in zip(outputs, derivatives):
+                self.assertAlmostEqual(dfx, act_func.derivative(fx))
+
+    def test_output_delta(self):
+        for act_func in self.act_funcs:
+            outputs = act_func.activate_vec(numpy.array(self.inputs))
+            targets = numpy.linspace(0, 1, len(self.inputs))
+            deltas = act_func.output_delta(outputs, targets)
+            for fx, y, delta in zip(outputs, targets, deltas):
+                if act_func.name == "logistic":
+                    expected = fx - y
+                else:
+                    expected = (fx - y) * act_func.derivative(fx)
+                self.assertAlmostEqual(delta, expected)
+
+    def test_logistic_activate_no_overflow(self):
+        act_func = pine.activation.Logistic()
+        self.assertEqual(act_func.activate(-1000.0), 0.0)
+        self.assertEqual(act_func.activate(1000.0), 1.0)
+
+    def test_logistic_activate_vec_no_overflow(self):
+        outputs = pine.activation.Logistic().activate_vec(
+                      numpy.array([-1000.0, 1000.0]))
+        self.assertEqual(list(outputs), [0.0, 1.0])
 
     def tearDown(self):
         pass